@@ -1,45 +1,80 @@
 import argparse
 import os
-from src.image_utils import get_image_dimensions, get_image_geolocation, overlay_map_on_image
+from concurrent.futures import ThreadPoolExecutor
+from src.image_utils import get_image_dimensions, load_image, get_image_geolocation, overlay_map_on_image
 from src.map_generator import generate_map_image
 from PIL import Image # Required for saving the image, and potentially for other image ops if not handled by utils
 
+# Baseline JPEG encoding, pinned explicitly (these match Pillow's defaults: no extra Huffman
+# optimisation pass, no progressive scans, 4:2:0 chroma); quality is set by --quality
+JPEG_SAVE_OPTIONS = {"optimize": False, "progressive": False, "subsampling": 2}
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+def _jpeg_quality(value):
+    """
+    argparse type for --quality: an integer from 1 to 95.
+    """
+    quality = int(value)
+    if not 1 <= quality <= 95:
+        raise argparse.ArgumentTypeError(f"JPEG quality must be between 1 and 95, got {quality}")
+    return quality
+
 def main():
     parser = argparse.ArgumentParser(description="Overlays a geolocation map onto an image.")
     parser.add_argument("image_path", help="Path to the input image.")
     parser.add_argument("--output_path", help="Path to save the output image. Defaults to 'output.jpg' in the input image's directory.")
     parser.add_argument("--zoom", type=int, default=10, help="Map zoom level. Defaults to 10.")
+    parser.add_argument("--quality", type=_jpeg_quality, default=90, help="JPEG quality (1-95). Defaults to 90.")
 
     args = parser.parse_args()
 
-    # Get image dimensions
-    original_dimensions = get_image_dimensions(args.image_path)
-    if not original_dimensions:
+    # Open the image once: the same handle feeds the header, EXIF and pixel reads
+    try:
+        with open(args.image_path, 'rb') as image_file:
+            # Get image dimensions (header only, the pixels are decoded later)
+            original_dimensions = get_image_dimensions(image_file)
+            if not original_dimensions:
+                print(f"Could not get dimensions for image: {args.image_path}")
+                return
+            original_width, original_height = original_dimensions
+
+            # Get image geolocation
+            geolocation = get_image_geolocation(image_file)
+            if not geolocation:
+                print(f"Could not get geolocation for image: {args.image_path}. GPS EXIF data might be missing.")
+                return
+            lat, lon = geolocation
+
+            # Calculate map dimensions (e.g., 1/3rd of the original image size)
+            map_width = original_width // 3
+            map_height = original_height // 3
+
+            # Generate map image in the background and decode the photo while the tiles download.
+            # Only this thread touches image_file, so the shared handle is never read concurrently.
+            print(f"Generating map for Lat: {lat}, Lon: {lon} with zoom: {args.zoom}")
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                map_future = executor.submit(generate_map_image, lat, lon, map_width, map_height, zoom=args.zoom)
+                original_image = load_image(image_file)
+                map_pillow_image = map_future.result()
+    except FileNotFoundError:
+        print(f"Error: Image file not found at {args.image_path}")
+        return
+    except OSError as e:
+        # e.g. a directory or an unreadable file
+        print(f"Error opening or reading image: {e}")
         print(f"Could not get dimensions for image: {args.image_path}")
         return
-    original_width, original_height = original_dimensions
 
-    # Get image geolocation
-    geolocation = get_image_geolocation(args.image_path)
-    if not geolocation:
-        print(f"Could not get geolocation for image: {args.image_path}. GPS EXIF data might be missing.")
+    if not original_image:
+        print(f"Could not load image: {args.image_path}")
         return
-    lat, lon = geolocation
-
-    # Calculate map dimensions (e.g., 1/3rd of the original image size)
-    map_width = original_width // 3
-    map_height = original_height // 3
-
-    # Generate map image
-    print(f"Generating map for Lat: {lat}, Lon: {lon} with zoom: {args.zoom}")
-    map_pillow_image = generate_map_image(lat, lon, map_width, map_height, zoom=args.zoom)
     if not map_pillow_image:
         print("Could not generate map image.")
         return
 
     # Overlay map on the original image
     print("Overlaying map on image...")
-    final_image = overlay_map_on_image(args.image_path, map_pillow_image)
+    final_image = overlay_map_on_image(original_image, map_pillow_image)
     if not final_image:
         print("Could not overlay map on image.")
         return
@@ -52,7 +87,7 @@ def main():
         if not input_dir: # If image_path is just a filename without a directory
             input_dir = "."
         output_path = os.path.join(input_dir, "output.jpg")
-    elif os.path.sep not in args.output_path and "/" not in args.output_path : # if it's just a filename
+    elif not os.path.dirname(output_path): # if it's just a filename
         input_dir = os.path.dirname(args.image_path)
         if not input_dir:
             input_dir = "."
@@ -66,10 +101,14 @@ def main():
 
     # Save the final image
     try:
-        # Convert to RGB if saving as JPEG, as JPEG doesn't support alpha
-        if output_path.lower().endswith(".jpg") or output_path.lower().endswith(".jpeg"):
-            final_image = final_image.convert('RGB')
-        final_image.save(output_path)
+        # The map is blended straight into the RGB original, so this is normally ready for JPEG.
+        # Convert only if needed: convert() on an RGB image would still copy the whole photo.
+        if os.path.splitext(output_path)[1].casefold() in JPEG_EXTENSIONS:
+            if final_image.mode != 'RGB':
+                final_image = final_image.convert('RGB')
+            final_image.save(output_path, 'JPEG', quality=args.quality, **JPEG_SAVE_OPTIONS)
+        else:
+            final_image.save(output_path)
         print(f"Output image saved to: {output_path}")
     except Exception as e:
         print(f"Error saving final image: {e}")
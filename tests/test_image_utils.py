@@ -1,10 +1,11 @@
 import pytest
 from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
 import os
 from unittest.mock import patch, Mock # Import Mock for creating custom mock objects
 import types # For SimpleNamespace if needed, or just use Mock
 # No longer attempting to import IfdTag or Ratio from exifread directly
-from src.image_utils import get_image_dimensions, get_image_geolocation, overlay_map_on_image
+from src.image_utils import get_image_dimensions, load_image, get_image_geolocation, overlay_map_on_image
 
 # Define the path to the sample image, assuming it's in static/ relative to the project root
 # This image (Canon_40D.jpg) is known NOT to have GPS after previous test runs.
@@ -14,6 +15,7 @@ SAMPLE_IMAGE_PATH = "static/sample_image_with_gps.jpg"
 # For a test of no_gps, we can use a text file or a newly created minimal image
 EMPTY_TEXT_FILE_PATH = "static/empty_file_for_gps_test.txt" # Will create this
 TEMP_IMAGE_NO_GPS_PATH = "static/temp_no_gps_image.png" # Will create this
+TEMP_IMAGE_WITH_GPS_PATH = "static/temp_gps_image.jpg" # Will create this, with real GPS EXIF
 
 @pytest.fixture(scope="module", autouse=True)
 def setup_test_files():
@@ -28,6 +30,17 @@ def setup_test_files():
     except Exception as e:
         print(f"Warning: Could not create temp image for no_gps test: {e}")
 
+    # Create a JPEG with GPS EXIF: 34 deg 3 min 2.52 sec North, 118 deg 14 min 25.8 sec West
+    try:
+        exif = Image.Exif()
+        exif.get_ifd(0x8825).update({
+            1: 'N', 2: (IFDRational(34), IFDRational(3), IFDRational(252, 100)),
+            3: 'W', 4: (IFDRational(118), IFDRational(14), IFDRational(258, 10)),
+        })
+        Image.new('RGB', (10, 10), color='green').save(TEMP_IMAGE_WITH_GPS_PATH, exif=exif)
+    except Exception as e:
+        print(f"Warning: Could not create temp image for gps test: {e}")
+
     yield
 
     # Teardown: Remove created files
@@ -35,6 +48,8 @@ def setup_test_files():
         os.remove(EMPTY_TEXT_FILE_PATH)
     if os.path.exists(TEMP_IMAGE_NO_GPS_PATH):
         os.remove(TEMP_IMAGE_NO_GPS_PATH)
+    if os.path.exists(TEMP_IMAGE_WITH_GPS_PATH):
+        os.remove(TEMP_IMAGE_WITH_GPS_PATH)
 
 
 def test_get_image_dimensions():
@@ -46,6 +61,32 @@ def test_get_image_dimensions():
     assert isinstance(width, int) and width > 0, "Width should be a positive integer."
     assert isinstance(height, int) and height > 0, "Height should be a positive integer."
 
+def test_load_image():
+    assert os.path.exists(SAMPLE_IMAGE_PATH), f"Sample image not found at {SAMPLE_IMAGE_PATH}"
+    with open(SAMPLE_IMAGE_PATH, 'rb') as f:
+        img = load_image(f)
+        # The handle must stay usable for the EXIF parse that follows in main()
+        assert not f.closed, "load_image should not close a caller-owned file object."
+    assert isinstance(img, Image.Image), "Should return a Pillow Image instance."
+    assert img.mode == 'RGB', "Loaded image should be in RGB mode."
+    assert img.size == get_image_dimensions(SAMPLE_IMAGE_PATH), "Loaded image size should match the file."
+
+def test_load_image_keeps_transparency(tmp_path):
+    # Inputs with alpha stay RGBA so a PNG output keeps its transparent areas
+    rgba_path = str(tmp_path / "rgba.png")
+    Image.new('RGBA', (10, 10), (255, 0, 0, 0)).save(rgba_path)
+    palette_path = str(tmp_path / "palette.png")
+    Image.new('P', (10, 10), 0).save(palette_path, transparency=0)
+
+    rgba_img = load_image(rgba_path)
+    assert rgba_img.mode == 'RGBA', "RGBA input should keep its alpha channel."
+    assert rgba_img.getpixel((0, 0))[3] == 0, "Transparent pixels should stay transparent."
+    assert load_image(palette_path).mode == 'RGBA', "Palette transparency should be kept as alpha."
+    assert load_image(TEMP_IMAGE_NO_GPS_PATH).mode == 'RGB', "Opaque input should be loaded as RGB."
+
+def test_load_image_missing_file():
+    assert load_image("static/does_not_exist.jpg") is None, "Should return None for a missing file."
+
 @patch('exifread.process_file') # Patching at the source of the exifread module
 def test_get_image_geolocation_valid_gps(mock_process_file):
     # Mock the return value of exifread.process_file
@@ -82,11 +123,12 @@ def test_get_image_geolocation_valid_gps(mock_process_file):
     }
     mock_process_file.return_value = mock_tags
 
-    # Even though we mock process_file, the function still needs a valid file path to open
-    # So, we use the existing SAMPLE_IMAGE_PATH, its content doesn't matter for this mocked part
-    assert os.path.exists(SAMPLE_IMAGE_PATH), f"Sample image not found at {SAMPLE_IMAGE_PATH}, needed for file open."
+    # Even though we mock process_file, the function still needs a valid file path to open.
+    # JPEGs are read by the built-in EXIF reader, so use the PNG, which goes through exifread.
+    if not os.path.exists(TEMP_IMAGE_NO_GPS_PATH):
+        pytest.skip("Temporary image for exifread fallback test not created.")
 
-    geolocation = get_image_geolocation(SAMPLE_IMAGE_PATH)
+    geolocation = get_image_geolocation(TEMP_IMAGE_NO_GPS_PATH)
 
     mock_process_file.assert_called_once() # Check that it was called
     # To check arguments, would need to inspect mock_process_file.call_args
@@ -106,6 +148,33 @@ def test_get_image_geolocation_valid_gps(mock_process_file):
     assert abs(lon - (-118.2405)) < 0.0001, "Mocked longitude not calculated as expected."
 
 
+@patch('exifread.process_file')
+def test_get_image_geolocation_jpeg_gps(mock_process_file):
+    # GPS in a JPEG is read straight from the EXIF segment, without exifread
+    if not os.path.exists(TEMP_IMAGE_WITH_GPS_PATH):
+        pytest.skip("Temporary image for gps test not created.")
+    geolocation = get_image_geolocation(TEMP_IMAGE_WITH_GPS_PATH)
+
+    mock_process_file.assert_not_called()
+    assert isinstance(geolocation, tuple), "Should return a tuple for valid GPS data."
+    lat, lon = geolocation
+    assert abs(lat - 34.0507) < 0.0001, "Latitude not read as expected."
+    assert abs(lon - (-118.2405)) < 0.0001, "Longitude not read as expected."
+
+
+def test_get_image_geolocation_jpeg_invalid_ref(tmp_path):
+    # An empty latitude ref must not be read as 'not N' and silently negate the latitude
+    exif = Image.Exif()
+    exif.get_ifd(0x8825).update({
+        1: '', 2: (IFDRational(34), IFDRational(3), IFDRational(0)),
+        3: 'W', 4: (IFDRational(118), IFDRational(14), IFDRational(0)),
+    })
+    path = str(tmp_path / "invalid_ref.jpg")
+    Image.new('RGB', (10, 10), color='green').save(path, exif=exif)
+
+    assert get_image_geolocation(path) is None, "Should return None when a GPS ref is not N/S or E/W."
+
+
 def test_get_image_geolocation_no_gps_using_sample_image():
     # This test now uses the actual SAMPLE_IMAGE_PATH (Canon_40D.jpg)
     # which we've established (from previous failed tests) does not have GPS data.
@@ -115,6 +184,14 @@ def test_get_image_geolocation_no_gps_using_sample_image():
     assert geolocation is None, f"Should return None for {SAMPLE_IMAGE_PATH} which is expected to have no GPS."
 
 
+def test_get_image_geolocation_file_object():
+    # A shared, already-read file handle should be accepted in place of a path
+    with open(SAMPLE_IMAGE_PATH, 'rb') as f:
+        f.read()
+        geolocation = get_image_geolocation(f)
+    assert geolocation is None, f"Should return None for {SAMPLE_IMAGE_PATH} which is expected to have no GPS."
+
+
 def test_get_image_geolocation_no_gps_temp_image():
     # Test with an image explicitly created without GPS info
     if not os.path.exists(TEMP_IMAGE_NO_GPS_PATH):
@@ -130,13 +207,13 @@ def test_get_image_geolocation_non_image_file():
 
 def test_overlay_map_on_image():
     assert os.path.exists(SAMPLE_IMAGE_PATH), f"Sample image not found at {SAMPLE_IMAGE_PATH}"
-    original_img_pil = Image.open(SAMPLE_IMAGE_PATH)
+    original_img_pil = load_image(SAMPLE_IMAGE_PATH)
     original_width, original_height = original_img_pil.size
 
     # Create a dummy map Pillow image
     map_image = Image.new('RGBA', (original_width // 4, original_height // 4), 'blue')
 
-    composite_image = overlay_map_on_image(SAMPLE_IMAGE_PATH, map_image)
+    composite_image = overlay_map_on_image(original_img_pil, map_image)
 
     assert composite_image is not None, "overlay_map_on_image should return an image object."
     assert isinstance(composite_image, Image.Image), "Should return a Pillow Image instance."
@@ -145,8 +222,8 @@ def test_overlay_map_on_image():
     assert composite_image.width == original_width, "Width of composite image should match original."
     assert composite_image.height == original_height, "Height of composite image should match original."
 
-    # Assert the output image mode is 'RGBA' (as specified in the function)
-    assert composite_image.mode == 'RGBA', "Composite image mode should be RGBA."
+    # The overlay is blended into the original in its own mode, no RGBA copy of the full image is made
+    assert composite_image.mode == 'RGB', "Composite image mode should stay RGB for an opaque original."
 
     # More detailed pixel checks could be added here if necessary
     # For example, checking a pixel in the map area and one outside
@@ -158,3 +235,18 @@ def test_overlay_map_on_image():
     # This depends heavily on the map size and content.
     # For the blue map: map_area_pixel might be (0,0,255, alpha) or blended.
     # For now, the above checks are sufficient.
+
+
+def test_overlay_map_on_image_half_opacity():
+    # White base with a black opaque map and a half-transparent map: the map
+    # area should be blended at 50% and the rest of the image left untouched.
+    original = Image.new('RGB', (90, 60), 'white')
+    opaque_map = Image.new('RGB', (30, 20), 'black')
+    composite_image = overlay_map_on_image(original, opaque_map)
+    assert composite_image.getpixel((5, 55))[:3] == (128, 128, 128), "Opaque map should be blended at 50%."
+    assert composite_image.getpixel((85, 5))[:3] == (255, 255, 255), "Pixels outside the map should be unchanged."
+
+    original = Image.new('RGB', (90, 60), 'white')
+    transparent_map = Image.new('RGBA', (30, 20), (0, 0, 0, 0))
+    composite_image = overlay_map_on_image(original, transparent_map)
+    assert composite_image.getpixel((5, 55))[:3] == (255, 255, 255), "Fully transparent map pixels should not show."
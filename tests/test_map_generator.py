@@ -1,6 +1,15 @@
 import pytest
+from io import BytesIO
+from pathlib import Path
 from PIL import Image
-from src.map_generator import generate_map_image
+from unittest.mock import Mock, patch
+from src import map_generator
+from src.map_generator import generate_map_image, CachedStaticMap
+
+@pytest.fixture(autouse=True)
+def isolated_tile_cache(tmp_path, monkeypatch):
+    # Keep downloaded tiles out of the developer's real ~/.cache
+    monkeypatch.setattr(map_generator, 'TILE_CACHE_DIR', str(tmp_path))
 
 def test_generate_map_image():
     # Define sample parameters
@@ -70,3 +79,86 @@ def test_generate_map_invalid_inputs():
     # Let's assume staticmap raises an error for negative dimensions.
     map_img_negative_dims = generate_map_image(0,0, -100, 50, zoom=1)
     assert map_img_negative_dims is None, "Should return None if staticmap fails due to negative dimensions."
+
+def _tile_png(color='white'):
+    buffer = BytesIO()
+    Image.new('RGB', (256, 256), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def test_cached_static_map_reuses_tiles(tmp_path):
+    # The first request goes to the network, the second is served from the disk cache
+    tile = _tile_png()
+    session = Mock()
+    session.get.return_value = Mock(status_code=200, content=tile)
+    m = CachedStaticMap(256, 256, cache_dir=str(tmp_path), session=session)
+    url = "https://a.tile.openstreetmap.org/10/163/395.png"
+
+    assert m.get(url, timeout=None) == (200, tile)
+    assert m.get(url, timeout=None) == (200, tile)
+    session.get.assert_called_once()
+    assert [p.read_bytes() for p in tmp_path.rglob('*') if p.is_file()] == [tile]
+
+def test_cached_static_map_keys_on_query_string(tmp_path):
+    # Tiles differing only in the query string must not share a cache entry
+    tile_a, tile_b = _tile_png(), _tile_png('black')
+    session = Mock()
+    m = CachedStaticMap(256, 256, cache_dir=str(tmp_path), session=session)
+
+    session.get.return_value = Mock(status_code=200, content=tile_a)
+    assert m.get("https://tiles.example.com/tile?z=10&x=163&y=395") == (200, tile_a)
+    session.get.return_value = Mock(status_code=200, content=tile_b)
+    assert m.get("https://tiles.example.com/tile?z=10&x=163&y=396") == (200, tile_b)
+    assert m.get("https://tiles.example.com/tile?z=10&x=163&y=395") == (200, tile_a)
+    assert session.get.call_count == 2
+
+def test_cached_static_map_does_not_cache_failures(tmp_path):
+    session = Mock()
+    session.get.return_value = Mock(status_code=404, content=b'')
+    m = CachedStaticMap(256, 256, cache_dir=str(tmp_path), session=session)
+    url = "https://a.tile.openstreetmap.org/10/163/395.png"
+
+    assert m.get(url)[0] == 404
+    assert m.get(url)[0] == 404
+    assert session.get.call_count == 2, "Failed tile requests should not be cached."
+
+def test_cached_static_map_rejects_non_image_tiles(tmp_path):
+    # A 200 response that is not an image (e.g. a captive portal page) is reported as failed, not cached
+    session = Mock()
+    session.get.return_value = Mock(status_code=200, content=b'<html>Please log in</html>')
+    m = CachedStaticMap(256, 256, cache_dir=str(tmp_path), session=session)
+    url = "https://a.tile.openstreetmap.org/10/163/395.png"
+
+    assert m.get(url)[0] is None
+    assert not any(p.is_file() for p in tmp_path.rglob('*')), "Non-image responses should not be cached."
+
+    # A corrupt entry already in the cache is dropped and refetched
+    tile = _tile_png()
+    session.get.return_value = Mock(status_code=200, content=tile)
+    cached_tile = Path(m._cache_path(url))
+    cached_tile.parent.mkdir(parents=True)
+    cached_tile.write_bytes(b'<html>Please log in</html>')
+
+    assert m.get(url) == (200, tile)
+    assert cached_tile.read_bytes() == tile
+
+@patch('src.map_generator.CachedStaticMap')
+def test_generate_map_image_large_is_upscaled(mock_static_map, tmp_path):
+    # A 2000x1333 map is rendered at 500x334 two zoom levels out, then upscaled
+    mock_static_map.return_value.render.side_effect = (
+        lambda zoom: Image.new('RGB', mock_static_map.call_args[0], 'white'))
+
+    map_img = generate_map_image(34.0522, -118.2437, 2000, 1333, zoom=10)
+
+    mock_static_map.assert_called_once_with(500, 334, cache_dir=str(tmp_path))
+    mock_static_map.return_value.render.assert_called_once_with(zoom=8)
+    assert map_img.size == (2000, 1333), "Map should be upscaled to the requested size."
+
+@patch('src.map_generator.CachedStaticMap')
+def test_generate_map_image_small_is_rendered_directly(mock_static_map, tmp_path):
+    mock_static_map.return_value.render.return_value = Image.new('RGB', (200, 150), 'white')
+
+    map_img = generate_map_image(0.0, 0.0, 200, 150, zoom=10)
+
+    mock_static_map.assert_called_once_with(200, 150, cache_dir=str(tmp_path))
+    mock_static_map.return_value.render.assert_called_once_with(zoom=10)
+    assert map_img.size == (200, 150)